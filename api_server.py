@@ -5,74 +5,431 @@ Provides endpoints for the frontend to access real history data
 """
 
 import json
+import mimetypes
+import mmap
 import os
+import tempfile
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
-from flask import Flask, jsonify, send_file, request
+from urllib.parse import quote
+from flask import Flask, Response, jsonify, send_file, request
+from flask.json.provider import DefaultJSONProvider
+from flask_caching import Cache
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib json module
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads within one process are serialised
+    fcntl = None
 
 app = Flask(__name__)
 CORS(app)
 
+# Trust X-Forwarded-* headers only when a reverse proxy sets them (BEHIND_PROXY=1, see
+# config/nginx.conf); otherwise any client could spoof its address and scheme
+if os.environ.get("BEHIND_PROXY") == "1":
+    app.wsgi_app = ProxyFix(app.wsgi_app)
+app.config["SEND_FILE_MAX_AGE_DEFAULT"] = 31536000
+
+# Short-lived response cache for dashboard polling. The Streamlit apps write
+# history from other processes, so entries expire instead of being invalidated.
+cache = Cache(app, config={"CACHE_TYPE": "SimpleCache", "CACHE_DEFAULT_TIMEOUT": 5})
+
+def is_cacheable(response):
+    """Only cache successful responses; errors are returned as (body, status) tuples"""
+    return not isinstance(response, tuple)
+
+if orjson is not None:
+    class ORJSONProvider(DefaultJSONProvider):
+        """Encode and decode JSON responses with orjson"""
+        
+        def dumps(self, obj, **kwargs):
+            return orjson.dumps(obj).decode()
+        
+        def loads(self, s, **kwargs):
+            return orjson.loads(s)
+    
+    app.json = ORJSONProvider(app)
+
+# Let a fronting server stream image files with sendfile(2) instead of Python.
+# X_ACCEL_PREFIX names an nginx internal location mapped to the uploads folder,
+# USE_X_SENDFILE=1 enables the Apache/lighttpd X-Sendfile header.
+X_ACCEL_PREFIX = os.environ.get("X_ACCEL_PREFIX")
+app.use_x_sendfile = os.environ.get("USE_X_SENDFILE") == "1"
+
+# Uploaded images are never rewritten under the same name, so browsers may cache them
+IMAGE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+IMAGE_EXTENSIONS = frozenset({"png", "jpg", "jpeg"})
+
 # Base paths
 UPLOADS_DIR = Path("uploads")
 FRONTEND_DIR = Path("frontend")
 
+# Ensure uploads directory exists (gunicorn imports the module without running __main__)
+UPLOADS_DIR.mkdir(exist_ok=True)
+
+# History is stored per entry type in each user folder, either as an append-only
+# JSON Lines log (oldest first) or as a JSON list (newest first)
+HISTORY_TYPES = ('pregnancy_risk', 'fetal_classification')
+HISTORY_LIMIT = 100
+LEGACY_HISTORY_FILE = 'medical_history.json'
+# Any of these in a user folder means the user has history
+HISTORY_FILE_NAMES = (
+    *(f'{entry_type}{ext}' for entry_type in HISTORY_TYPES for ext in ('.jsonl', '.json')),
+    LEGACY_HISTORY_FILE
+)
+
+# Parsed history shards keyed by (user_id, type), validated against the shard's mtime and size
+HISTORY_CACHE_SIZE = 1024
+HISTORY_LOAD_WORKERS = 8
+_HISTORY_CACHE = OrderedDict()
+_RESPONSE_CACHE = OrderedDict()
+_HISTORY_CACHE_LOCK = threading.Lock()
+
+# Large cleanups unlink files from a thread pool so metadata I/O overlaps
+PARALLEL_UNLINK_THRESHOLD = 64
+UNLINK_WORKERS = 32
+
+# Manifest of user ids with history, maintained by the apps' history writers
+USERS_MANIFEST = UPLOADS_DIR / '_users.json'
+_USERS_CACHE = None
+_USERS_CACHE_LOCK = threading.Lock()
+_MANIFEST_LOCK = threading.Lock()
+
+def read_json(path):
+    """Parse a JSON file, using orjson when it is installed"""
+    if orjson is not None:
+        with open(path, 'rb') as f:
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                return orjson.loads(f.read())
+            # Parse straight from the shared page cache instead of copying into bytes
+            with mapped, memoryview(mapped) as view:
+                return orjson.loads(view)
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def read_json_lines(path, limit):
+    """Parse the last `limit` records of a JSON Lines log, newest first"""
+    loads = orjson.loads if orjson is not None else json.loads
+    with open(path, 'rb') as f:
+        tail = deque(f, maxlen=limit)
+    
+    entries = []
+    for line in reversed(tail):
+        try:
+            entries.append(loads(line))
+        except ValueError:  # blank line or a record still being appended
+            continue
+    return entries
+
+def write_json_atomic(path, obj, **kwargs):
+    """Write JSON through a unique temp file and rename it into place, so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(obj, f, **kwargs)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+def migrate_legacy_history(user_folder, entry_type):
+    """Write a missing per-type shard from a legacy combined medical_history.json.
+    
+    `user_folder` must already be validated by resolve_user_folder.
+    """
+    legacy_file = user_folder / LEGACY_HISTORY_FILE
+    if not legacy_file.exists():
+        return
+    
+    history = read_json(legacy_file)
+    if isinstance(history, list):
+        entries = [entry for entry in history if entry.get('type') == entry_type]
+    else:
+        entries = history.get(entry_type, [])
+    write_json_atomic(user_folder / f'{entry_type}.json', entries, indent=2)
+
+def stat_history_file(user_folder, entry_type):
+    """Find the file holding one type of history and a stamp that changes with its content, or (None, None)"""
+    # Prefer the append-only log; older writers keep a JSON list
+    for name in (f'{entry_type}.jsonl', f'{entry_type}.json'):
+        history_file = user_folder / name
+        try:
+            stat = history_file.stat()
+        except FileNotFoundError:
+            continue
+        # mtimes are tick-granular, so two appends can share one; the size still grows, and
+        # a compaction or migration renames a new inode into place
+        return history_file, (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+    return None, None
+
+@lru_cache(maxsize=4096)
+def resolve_user_folder(user_id):
+    """Resolve a user's folder directly inside the uploads folder, or None if the id is not allowed"""
+    # Ids arrive from URLs and JSON bodies; only a single plain path component is a user id
+    if user_id in ('', '.', '..') or '\0' in user_id or os.sep in user_id or (os.altsep and os.altsep in user_id):
+        return None
+    
+    uploads_root = os.path.realpath(UPLOADS_DIR)
+    user_folder = os.path.realpath(os.path.join(uploads_root, user_id))
+    
+    # Reject anything that resolves outside the uploads folder, e.g. through a symlink
+    if os.path.dirname(user_folder) != uploads_root:
+        return None
+    
+    return Path(user_folder)
+
+def load_history_shard(user_id, entry_type):
+    """Load one type of a user's history, reusing the cached copy while the shard is unchanged"""
+    user_folder = resolve_user_folder(user_id)
+    if user_folder is None:
+        raise ValueError(f"Invalid user id: {user_id!r}")
+    
+    history_file, stamp = stat_history_file(user_folder, entry_type)
+    if history_file is None:
+        migrate_legacy_history(user_folder, entry_type)
+        history_file, stamp = stat_history_file(user_folder, entry_type)
+        if history_file is None:
+            return []
+    
+    key = (user_id, entry_type)
+    version = (history_file.name, stamp)
+    with _HISTORY_CACHE_LOCK:
+        cached = _HISTORY_CACHE.get(key)
+        if cached is not None and cached[0] == version:
+            _HISTORY_CACHE.move_to_end(key)
+            return cached[1]
+    
+    if history_file.suffix == '.jsonl':
+        entries = read_json_lines(history_file, HISTORY_LIMIT)
+    else:
+        entries = read_json(history_file)
+    
+    with _HISTORY_CACHE_LOCK:
+        _HISTORY_CACHE[key] = (version, entries)
+        _HISTORY_CACHE.move_to_end(key)
+        while len(_HISTORY_CACHE) > HISTORY_CACHE_SIZE:
+            _HISTORY_CACHE.popitem(last=False)
+    
+    return entries
+
+def dump_json(obj):
+    """Serialize to JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode()
+
+def load_history_payload(user_id):
+    """Load a user's history in the shape returned by the history endpoints"""
+    pregnancy_risk = load_history_shard(user_id, 'pregnancy_risk')
+    fetal_classification = load_history_shard(user_id, 'fetal_classification')
+    
+    return {
+        "pregnancyRisk": pregnancy_risk,
+        "fetalClassification": fetal_classification,
+        "total": len(pregnancy_risk) + len(fetal_classification)
+    }
+
+def load_history_body(user_id):
+    """Serialized history payload, re-encoded only when one of the shards was reloaded"""
+    payload = load_history_payload(user_id)
+    pregnancy_risk = payload["pregnancyRisk"]
+    fetal_classification = payload["fetalClassification"]
+    
+    # Cached shards come back as the same list objects, so identity marks them unchanged
+    with _HISTORY_CACHE_LOCK:
+        cached = _RESPONSE_CACHE.get(user_id)
+        if cached is not None and cached[0] is pregnancy_risk and cached[1] is fetal_classification:
+            _RESPONSE_CACHE.move_to_end(user_id)
+            return cached[2]
+    
+    body = dump_json(payload)
+    
+    with _HISTORY_CACHE_LOCK:
+        _RESPONSE_CACHE[user_id] = (pregnancy_risk, fetal_classification, body)
+        _RESPONSE_CACHE.move_to_end(user_id)
+        while len(_RESPONSE_CACHE) > HISTORY_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+    
+    return body
+
 @app.route('/api/history/<user_id>')
+@cache.cached(timeout=5, response_filter=is_cacheable)
 def get_user_history(user_id):
     """Get medical history for a specific user"""
     try:
-        user_folder = UPLOADS_DIR / user_id
-        history_file = user_folder / 'medical_history.json'
+        if resolve_user_folder(user_id) is None:
+            return jsonify({"error": "Invalid user id"}), 400
         
-        if not history_file.exists():
-            return jsonify({
-                "pregnancyRisk": [],
-                "fetalClassification": [],
-                "total": 0
-            })
+        return Response(load_history_body(user_id), mimetype='application/json')
+    
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/history', methods=['POST'])
+def get_batch_history():
+    """Get medical history for several users in one request"""
+    try:
+        data = request.get_json(silent=True) or {}
+        user_ids = data.get('user_ids')
+        if not isinstance(user_ids, list) or not all(isinstance(uid, str) for uid in user_ids):
+            return jsonify({"error": "Expected a JSON body with a 'user_ids' list"}), 400
         
-        with open(history_file, 'r') as f:
-            history = json.load(f)
+        # JSON ids bypass the route converter, so each one must resolve inside the uploads folder
+        if any(resolve_user_folder(uid) is None for uid in user_ids):
+            return jsonify({"error": "Invalid user id"}), 400
         
-        # Filter by type
-        pregnancy_risk = [entry for entry in history if entry.get('type') == 'pregnancy_risk']
-        fetal_classification = [entry for entry in history if entry.get('type') == 'fetal_classification']
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return jsonify({})
         
-        return jsonify({
-            "pregnancyRisk": pregnancy_risk,
-            "fetalClassification": fetal_classification,
-            "total": len(history)
-        })
+        # Each history file is independent I/O, so load them concurrently
+        with ThreadPoolExecutor(max_workers=min(HISTORY_LOAD_WORKERS, len(user_ids))) as pool:
+            payloads = pool.map(load_history_payload, user_ids)
+            return jsonify(dict(zip(user_ids, payloads)))
     
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@lru_cache(maxsize=4096)
+def resolve_upload_path(user_id, filename):
+    """Resolve an image path inside the uploads folder, or None if it is not allowed"""
+    if filename.rpartition('.')[2].lower() not in IMAGE_EXTENSIONS:
+        return None
+    
+    user_folder = resolve_user_folder(user_id)
+    if user_folder is None:
+        return None
+    
+    # The image must sit directly in the user's folder, also after resolving symlinks
+    file_path = os.path.realpath(os.path.join(user_folder, filename))
+    if os.path.dirname(file_path) != str(user_folder):
+        return None
+    
+    return file_path
+
 @app.route('/uploads/<user_id>/<filename>')
 def serve_user_image(user_id, filename):
-    """Serve images from user-specific folders"""
+    """Serve images from user-specific folders (nginx serves these directly in production)"""
     try:
-        file_path = UPLOADS_DIR / user_id / filename
-        if file_path.exists():
-            return send_file(file_path)
-        else:
+        file_path = resolve_upload_path(user_id, filename)
+        if file_path is None:
             return "File not found", 404
+        
+        # One stat serves as the existence check and feeds the cache validators
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return "File not found", 404
+        
+        if X_ACCEL_PREFIX:
+            # nginx keeps the upstream Content-Type on an internal redirect
+            return Response(mimetype=mimetypes.guess_type(filename)[0], headers={
+                # Percent-encode the names so spaces, '?' or '%' can't alter the internal URI
+                "X-Accel-Redirect": f"{X_ACCEL_PREFIX.rstrip('/')}/{quote(user_id, safe='')}/{quote(filename, safe='')}",
+                "Cache-Control": IMAGE_CACHE_CONTROL
+            })
+        
+        # Uploads are never rewritten in place, so mtime and size identify the content
+        response = send_file(
+            file_path,
+            conditional=True,
+            etag=f"{stat.st_mtime_ns}-{stat.st_size}",
+            last_modified=stat.st_mtime
+        )
+        response.headers["Cache-Control"] = IMAGE_CACHE_CONTROL
+        return response
     except Exception as e:
         return str(e), 500
 
+def scan_users():
+    """Find users with history data by walking the uploads folder"""
+    users = []
+    with os.scandir(UPLOADS_DIR) as entries:
+        for entry in entries:
+            if entry.name.startswith("user_") and entry.is_dir(follow_symlinks=False):
+                if any(os.path.exists(os.path.join(entry.path, name)) for name in HISTORY_FILE_NAMES):
+                    users.append(entry.name)
+    return users
+
+@contextmanager
+def manifest_lock():
+    """Hold the users manifest lock shared with the apps' history writers (apps/history_store.py)"""
+    with _MANIFEST_LOCK:
+        if fcntl is None:
+            yield
+            return
+        with open(USERS_MANIFEST.with_name(f"{USERS_MANIFEST.name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def load_users():
+    """Read users from the manifest, rebuilding it with a full scan when missing"""
+    global _USERS_CACHE
+    
+    try:
+        mtime_ns = USERS_MANIFEST.stat().st_mtime_ns
+    except FileNotFoundError:
+        # Writers skip registration while the manifest is missing and check again under
+        # this lock, so a user who writes history during the scan is either seen by it or
+        # registers after the manifest exists
+        with manifest_lock():
+            if not USERS_MANIFEST.exists():
+                write_json_atomic(USERS_MANIFEST, sorted(scan_users()))
+        return load_users()
+    
+    with _USERS_CACHE_LOCK:
+        if _USERS_CACHE is not None and _USERS_CACHE[0] == mtime_ns:
+            return _USERS_CACHE[1]
+    
+    # Manifests written before the apps stopped registering anonymous sessions may list them
+    users = sorted(user_id for user_id in read_json(USERS_MANIFEST) if user_id.startswith("user_"))
+    
+    with _USERS_CACHE_LOCK:
+        _USERS_CACHE = (mtime_ns, users)
+    
+    return users
+
 @app.route('/api/users')
+@cache.cached(timeout=30, response_filter=is_cacheable)
 def list_users():
     """List all users who have history data"""
     try:
-        users = []
-        for user_folder in UPLOADS_DIR.glob("user_*"):
-            if user_folder.is_dir():
-                history_file = user_folder / 'medical_history.json'
-                if history_file.exists():
-                    users.append(user_folder.name)
-        return jsonify(users)
+        return jsonify(load_users())
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@lru_cache(maxsize=4096)
+def timestamp_base_name(name):
+    """Strip the timestamp prefix from an upload name (everything past the second underscore)"""
+    second_underscore = name.find('_', name.find('_') + 1)
+    return name[second_underscore + 1:] if second_underscore != -1 else name
+
+def remove_files(paths):
+    """Delete files, overlapping the unlink syscalls when there are many of them"""
+    if len(paths) < PARALLEL_UNLINK_THRESHOLD:
+        for path in paths:
+            os.unlink(path)
+    else:
+        with ThreadPoolExecutor(max_workers=UNLINK_WORKERS) as pool:
+            list(pool.map(os.unlink, paths))
+    return len(paths)
+
 @app.route('/api/cleanup/<user_id>')
 def cleanup_user_data(user_id):
     """Clean up old files and remove duplicates for a user"""
@@ -82,32 +439,30 @@ def cleanup_user_data(user_id):
             return jsonify({"message": "User folder not found"})
         
         # Remove duplicate images (same size and name pattern)
-        image_files = list(user_folder.glob("*.png")) + list(user_folder.glob("*.jpg")) + list(user_folder.glob("*.jpeg"))
+        with os.scandir(user_folder) as entries:
+            image_files = [
+                entry for entry in entries
+                if entry.name.rpartition(".")[2].lower() in IMAGE_EXTENSIONS
+                and entry.is_file(follow_symlinks=False)
+            ]
         
-        duplicates_removed = 0
-        file_groups = {}
+        newest = {}
+        to_delete = []
         
-        # Group files by their base name (without timestamp)
-        for file_path in image_files:
-            # Extract base name after timestamp
-            name_parts = file_path.name.split('_', 2)
-            if len(name_parts) >= 3:
-                base_name = name_parts[2]  # Everything after timestamp
+        # Keep only the newest file for each base name (without timestamp)
+        for entry in image_files:
+            base_name = timestamp_base_name(entry.name)
+            mtime_ns = entry.stat().st_mtime_ns
+            kept = newest.get(base_name)
+            if kept is None:
+                newest[base_name] = (entry, mtime_ns)
+            elif mtime_ns > kept[1]:
+                to_delete.append(kept[0])
+                newest[base_name] = (entry, mtime_ns)
             else:
-                base_name = file_path.name
-            
-            if base_name not in file_groups:
-                file_groups[base_name] = []
-            file_groups[base_name].append(file_path)
+                to_delete.append(entry)
         
-        # Keep only the newest file for each group
-        for base_name, files in file_groups.items():
-            if len(files) > 1:
-                # Sort by modification time, keep newest
-                files.sort(key=lambda f: f.stat().st_mtime, reverse=True)
-                for old_file in files[1:]:
-                    old_file.unlink()
-                    duplicates_removed += 1
+        duplicates_removed = remove_files([entry.path for entry in to_delete])
         
         return jsonify({
             "message": f"Cleanup completed. Removed {duplicates_removed} duplicate files.",
@@ -118,14 +473,24 @@ def cleanup_user_data(user_id):
         return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
-    # Ensure uploads directory exists
-    UPLOADS_DIR.mkdir(exist_ok=True)
+    if not os.environ.get("DEV"):
+        print("The Flask development server is single-threaded. Run the API with:")
+        print("  gunicorn -w 4 -k gthread --threads 16 -b 0.0.0.0:8503 api_server:app")
+        print("or set DEV=1 to start the development server anyway.")
+        raise SystemExit(1)
     
     print("Starting Medical History API Server...")
     print("Endpoints:")
     print("  GET /api/history/<user_id> - Get user's medical history")
+    print("  POST /api/history - Get medical history for a list of users")
     print("  GET /uploads/<user_id>/<filename> - Serve user images")
     print("  GET /api/users - List users with history data")
     print("  GET /api/cleanup/<user_id> - Clean up duplicate files")
     
-    app.run(host='0.0.0.0', port=8503, debug=True)
\ No newline at end of file
+    app.run(
+        host='0.0.0.0',
+        port=8503,
+        debug=os.environ.get("FLASK_DEBUG") == "1",
+        use_reloader=False,
+        threaded=True
+    )
\ No newline at end of file
@@ -0,0 +1,143 @@
+"""
+Per-user history storage shared by the Streamlit apps
+History lives in per-type JSON Lines logs inside each user's uploads folder
+"""
+
+import json
+import os
+import tempfile
+import threading
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import orjson
+except ImportError:  # optional: fall back to the stdlib json module
+    orjson = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads within one process are serialised
+    fcntl = None
+
+UPLOADS_DIR = Path(__file__).parent.parent / 'uploads'
+USERS_MANIFEST = UPLOADS_DIR / '_users.json'
+
+# Only authenticated users are listed by the API; anonymous sessions get random ids
+AUTHENTICATED_USER_PREFIX = 'user_'
+
+# Streamlit runs every session as a thread of one process, and this module is imported
+# once per process, so these locks serialise history and manifest writes across sessions
+_HISTORY_LOCK = threading.Lock()
+_MANIFEST_LOCK = threading.Lock()
+
+# History is an append-only JSON Lines log; readers keep the last HISTORY_LIMIT entries
+HISTORY_LIMIT = 100
+HISTORY_COMPACT_BYTES = 512 * 1024
+
+def read_json_file(path):
+    """Parse a JSON file, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(Path(path).read_bytes())
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def dump_json_line(entry):
+    """Serialize one history record as a newline-terminated JSON line"""
+    if orjson is not None:
+        return orjson.dumps(entry, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_APPEND_NEWLINE)
+    # NumPy scalars (e.g. the model confidence) expose .item() for the stdlib encoder
+    return (json.dumps(entry, default=lambda value: value.item()) + "\n").encode()
+
+def write_file_atomic(path, data):
+    """Write bytes through a unique temp file and rename it into place, so readers never see a partial file"""
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+@contextmanager
+def manifest_lock():
+    """Hold the users manifest lock across threads and, where flock exists, across the app processes"""
+    with _MANIFEST_LOCK:
+        if fcntl is None:
+            yield
+            return
+        with open(USERS_MANIFEST.with_name(f"{USERS_MANIFEST.name}.lock"), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def create_user_upload_folder(user_id):
+    """Create user-specific upload folder"""
+    user_upload_dir = UPLOADS_DIR / user_id
+    user_upload_dir.mkdir(parents=True, exist_ok=True)
+    return user_upload_dir
+
+def load_history_shard(user_folder, entry_type):
+    """Load one type of history, falling back to the legacy combined medical_history.json"""
+    shard_file = user_folder / f'{entry_type}.json'
+    if shard_file.exists():
+        return read_json_file(shard_file)
+    
+    legacy_file = user_folder / 'medical_history.json'
+    if legacy_file.exists():
+        stored = read_json_file(legacy_file)
+        if isinstance(stored, list):
+            return [entry for entry in stored if entry.get('type') == entry_type]
+        return stored.get(entry_type, [])
+    
+    return []
+
+def register_user(user_id):
+    """Add an authenticated user to the shared users manifest read by the API server"""
+    if not user_id.startswith(AUTHENTICATED_USER_PREFIX):
+        return
+    
+    # Read-modify-write under the lock so concurrent registrations are never lost
+    with manifest_lock():
+        # The API server builds the manifest from a full scan, under the same lock, the
+        # first time it is needed; that scan picks up this user's history
+        if not USERS_MANIFEST.exists():
+            return
+        
+        users = read_json_file(USERS_MANIFEST)
+        if user_id in users:
+            return
+        
+        users.append(user_id)
+        write_file_atomic(USERS_MANIFEST, json.dumps(sorted(users)).encode())
+
+def append_history_entry(user_id, entry_type, entry):
+    """Append one entry to the user's `<entry_type>.jsonl` log and register the user"""
+    user_folder = create_user_upload_folder(user_id)
+    history_file = user_folder / f'{entry_type}.jsonl'
+    
+    # Seeding and compaction rewrite the log, so sessions append one at a time
+    with _HISTORY_LOCK:
+        if not history_file.exists():
+            # Seed the log from the older JSON history files, oldest entry first
+            existing = load_history_shard(user_folder, entry_type)[:HISTORY_LIMIT]
+            write_file_atomic(history_file, b''.join(dump_json_line(old_entry) for old_entry in reversed(existing)))
+            legacy_shard = user_folder / f'{entry_type}.json'
+            if legacy_shard.exists():
+                legacy_shard.unlink()
+        
+        # Append the new entry as one line
+        with open(history_file, 'ab') as f:
+            f.write(dump_json_line(entry))
+        
+        # Readers only use the last HISTORY_LIMIT lines; trim the log once it grows well past that
+        if history_file.stat().st_size > HISTORY_COMPACT_BYTES:
+            with open(history_file, 'rb') as f:
+                tail = deque(f, maxlen=HISTORY_LIMIT)
+            write_file_atomic(history_file, b''.join(tail))
+    
+    register_user(user_id)
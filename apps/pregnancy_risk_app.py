@@ -1,6 +1,10 @@
 import streamlit as st
 import pandas as pd
 import numpy as np
+# Streamlit re-executes this script on every interaction but imports modules once per
+# process, so the training module applies the optional sklearnex patch a single time;
+# it must be imported before sklearn.ensemble
+from pregnancy_risk_prediction import FEATURE_ORDER, load_and_preprocess_data
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 from sklearn.model_selection import train_test_split
@@ -11,6 +15,18 @@ import uuid
 import datetime
 from pathlib import Path
 
+from history_store import append_history_entry, read_json_file
+
+# Training data and the artifacts written by pregnancy_risk_prediction.py
+DATA_FILE = '../data/Dataset - Updated.csv'
+MODEL_DIR = '../models'
+MODEL_PATH = os.path.join(MODEL_DIR, 'pregnancy_risk_model.pkl')
+LABEL_ENCODER_PATH = os.path.join(MODEL_DIR, 'label_encoder.pkl')
+FEATURE_COLUMNS_PATH = os.path.join(MODEL_DIR, 'feature_columns.pkl')
+CLASSES_PATH = os.path.join(MODEL_DIR, 'pregnancy_risk_classes.npy')
+COMPILED_MODEL_PATH = os.path.join(MODEL_DIR, 'pregnancy_risk_model_hb.zip')
+METRICS_PATH = os.path.join(MODEL_DIR, 'metrics.json')
+
 def get_user_id():
     """Get user ID from Clerk authentication or generate a session ID"""
     # Try to get user ID from query params (passed from frontend)
@@ -25,22 +41,9 @@ def get_user_id():
     
     return user_id
 
-def create_user_upload_folder(user_id):
-    """Create user-specific upload folder"""
-    # Use absolute path relative to project root
-    base_upload_dir = Path(__file__).parent.parent / 'uploads'
-    user_upload_dir = base_upload_dir / user_id
-    user_upload_dir.mkdir(parents=True, exist_ok=True)
-    return user_upload_dir
-
-# Removed individual prediction file saving - now using unified medical_history.json only
-
 def save_prediction_history(user_id, input_data, prediction, confidence, probability):
     """Save prediction result to unified medical history"""
     try:
-        user_folder = create_user_upload_folder(user_id)
-        history_file = user_folder / 'medical_history.json'
-        
         # Create history entry
         history_entry = {
             'id': str(uuid.uuid4()),
@@ -56,23 +59,7 @@ def save_prediction_history(user_id, input_data, prediction, confidence, probabi
             'user_id': user_id
         }
         
-        # Load existing history or create new
-        history = []
-        if history_file.exists():
-            import json
-            with open(history_file, 'r') as f:
-                history = json.load(f)
-        
-        # Add new entry at the beginning
-        history.insert(0, history_entry)
-        
-        # Keep only last 100 entries total
-        history = history[:100]
-        
-        # Save updated history
-        import json
-        with open(history_file, 'w') as f:
-            json.dump(history, f, indent=2)
+        append_history_entry(user_id, 'pregnancy_risk', history_entry)
         
         return True
     
@@ -86,8 +73,12 @@ st.set_page_config(
     layout="wide"
 )
 
-with open('../assets/static/css/style.css') as f:
-    st.markdown(f'<style>{f.read()}</style>', unsafe_allow_html=True)
+@st.cache_data
+def load_css():
+    """Read the shared stylesheet once instead of on every rerun"""
+    return (Path(__file__).parent.parent / 'assets' / 'static' / 'css' / 'style.css').read_text()
+
+st.markdown(f'<style>{load_css()}</style>', unsafe_allow_html=True)
 
 # Initialize user session
 user_id = get_user_id()
@@ -104,49 +95,99 @@ if 'session_user_id' in st.session_state and user_id == st.session_state.session
 else:
     st.success(f"👤 Authenticated User: {user_id[:8]}...")
 
-@st.cache_data
-def load_and_train_model():
-    df = pd.read_csv('../data/Dataset - Updated.csv')
-    
-    df = df.dropna(subset=['Risk Level'])
-    
-    numerical_cols = ['Age', 'Systolic BP', 'Diastolic', 'BS', 'Body Temp', 'BMI', 'Heart Rate']
-    for col in numerical_cols:
-        if col in df.columns:
-            df[col] = df[col].fillna(df[col].median())
-    
-    categorical_cols = ['Previous Complications', 'Preexisting Diabetes', 'Gestational Diabetes', 'Mental Health']
-    for col in categorical_cols:
-        if col in df.columns:
-            df[col] = df[col].fillna(df[col].mode()[0])
+@st.cache_resource
+def load_model():
+    """Load the model saved by pregnancy_risk_prediction.py, training one only if the pickles are missing or unloadable.
+    
+    Returns the model, the class labels indexed by encoded class, the feature columns and the accuracy.
+    """
+    model = None
+    if all(os.path.exists(path) for path in (MODEL_PATH, LABEL_ENCODER_PATH, FEATURE_COLUMNS_PATH)):
+        try:
+            model = joblib.load(MODEL_PATH)
+        except ImportError as e:
+            # A forest pickled with sklearnex patched in needs sklearnex installed to load
+            st.warning(f"Could not load the saved model ({e}); training a new one")
+    
+    if model is not None:
+        feature_columns = joblib.load(FEATURE_COLUMNS_PATH)
+        # Single-row predictions are dominated by joblib worker start-up, so score the trees serially
+        model.n_jobs = 1
+        
+        # Classes and accuracy recorded at training time mean neither the encoder nor the CSV is needed
+        if os.path.exists(CLASSES_PATH) and os.path.exists(METRICS_PATH):
+            classes = np.load(CLASSES_PATH, allow_pickle=False)
+            return model, classes, feature_columns, read_json_file(METRICS_PATH)['accuracy']
+        
+        le = joblib.load(LABEL_ENCODER_PATH)
+    else:
+        feature_columns = list(FEATURE_ORDER)
+        le = LabelEncoder()
     
-    feature_columns = ['Age', 'Systolic BP', 'Diastolic', 'BS', 'Body Temp', 'BMI', 
-                      'Previous Complications', 'Preexisting Diabetes', 'Gestational Diabetes', 
-                      'Mental Health', 'Heart Rate']
+    df = load_and_preprocess_data(DATA_FILE)
     
-    X = df[feature_columns]
+    # The forest works in float32 internally, so hand it float32 arrays rather than DataFrames
+    X = df[feature_columns].to_numpy(dtype=np.float32)
     y = df['Risk Level']
     
-    le = LabelEncoder()
-    y_encoded = le.fit_transform(y)
+    y_encoded = le.fit_transform(y) if model is None else le.transform(y)
     
+    # Same split as the training script, so a saved model is scored on its own held-out rows
     X_train, X_test, y_train, y_test = train_test_split(X, y_encoded, test_size=0.2, random_state=42, stratify=y_encoded)
     
-    model = RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42)
-    model.fit(X_train, y_train)
+    if model is None:
+        model = RandomForestClassifier(n_estimators=100, max_depth=10, random_state=42, n_jobs=1)
+        model.fit(X_train, y_train)
     
     y_pred = model.predict(X_test)
     accuracy = accuracy_score(y_test, y_pred)
     
-    return model, le, feature_columns, accuracy, df
+    return model, le.classes_, feature_columns, accuracy
+
+@st.cache_resource
+def load_compiled_model():
+    """Hummingbird-compiled forest exported by the training script, or None to score with sklearn"""
+    if not os.path.exists(COMPILED_MODEL_PATH):
+        return None
+    
+    try:
+        from hummingbird.ml import load
+    except ImportError:
+        return None
+    
+    return load(COMPILED_MODEL_PATH)
 
-model, label_encoder, feature_columns, accuracy, df = load_and_train_model()
+@st.cache_data
+def load_dataset_stats():
+    """Sample and risk level counts for the sidebar, so reruns never hash the full dataset"""
+    if os.path.exists(METRICS_PATH):
+        metrics = read_json_file(METRICS_PATH)
+        if 'n_total' in metrics:
+            return metrics['n_total'], metrics['n_high'], metrics['n_low']
+    
+    risk_levels = pd.read_csv(DATA_FILE, usecols=['Risk Level'])['Risk Level'].dropna()
+    counts = risk_levels.value_counts()
+    return len(risk_levels), int(counts.get('High', 0)), int(counts.get('Low', 0))
+
+@st.cache_data
+def feature_importance_table(_model, feature_columns):
+    """Model feature importances, most important first; the leading underscore keeps the model unhashed"""
+    return pd.DataFrame({
+        'Feature': feature_columns,
+        'Importance': _model.feature_importances_
+    }).sort_values('Importance', ascending=False)
+
+model, classes, feature_columns, accuracy = load_model()
+total_samples, high_risk_cases, low_risk_cases = load_dataset_stats()
+# The sklearn model stays loaded for accuracy and feature importances
+compiled_model = load_compiled_model()
+predictor = compiled_model if compiled_model is not None else model
 
 st.sidebar.header("Model Information")
 st.sidebar.metric("Model Accuracy", f"{accuracy:.2%}")
-st.sidebar.metric("Total Samples", len(df))
-st.sidebar.metric("High Risk Cases", len(df[df['Risk Level'] == 'High']))
-st.sidebar.metric("Low Risk Cases", len(df[df['Risk Level'] == 'Low']))
+st.sidebar.metric("Total Samples", total_samples)
+st.sidebar.metric("High Risk Cases", high_risk_cases)
+st.sidebar.metric("Low Risk Cases", low_risk_cases)
 
 st.header("Patient Information")
 
@@ -188,15 +229,21 @@ if st.button("Predict Risk Level", type="primary"):
         'Heart Rate': heart_rate
     }
     
-    patient_df = pd.DataFrame([patient_data], columns=feature_columns)
+    # One float32 input row per session, filled in the column order saved with the model
+    # Allocate only on the first prediction or when the saved feature columns change
+    patient_x = st.session_state.get('patient_x')
+    if patient_x is None or patient_x.shape != (1, len(feature_columns)):
+        patient_x = st.session_state['patient_x'] = np.empty((1, len(feature_columns)), dtype=np.float32)
+    patient_x[0] = [patient_data[col] for col in feature_columns]
     
-    prediction = model.predict(patient_df)[0]
-    probability = model.predict_proba(patient_df)[0]
+    # One pass over the trees; labels are encoded 0..n-1, so the argmax is the predicted class
+    probability = predictor.predict_proba(patient_x)[0]
+    prediction = int(probability.argmax())
     
-    risk_level = label_encoder.inverse_transform([prediction])[0]
+    risk_level = classes[prediction]
     
     # Save to unified medical history
-    save_prediction_history(user_id, patient_data, risk_level, float(max(probability)), probability)
+    save_prediction_history(user_id, patient_data, risk_level, probability[prediction], probability)
     
     st.success("✅ Prediction saved to medical history")
     
@@ -218,11 +265,7 @@ if st.button("Predict Risk Level", type="primary"):
     
     st.subheader("Risk Factors Analysis")
     
-    feature_importance = pd.DataFrame({
-        'Feature': feature_columns,
-        'Importance': model.feature_importances_,
-        'Patient_Value': [patient_data[col] for col in feature_columns]
-    }).sort_values('Importance', ascending=False)
+    feature_importance = feature_importance_table(model, tuple(feature_columns))
     
     st.write("**Model-based Risk Assessment:**")
     if risk_level == "High":
@@ -234,7 +277,7 @@ if st.button("Predict Risk Level", type="primary"):
     top_features = feature_importance.head(5)
     for _, row in top_features.iterrows():
         importance_pct = row['Importance'] * 100
-        st.write(f"• **{row['Feature']}**: {row['Patient_Value']} (Model weight: {importance_pct:.1f}%)")
+        st.write(f"• **{row['Feature']}**: {patient_data[row['Feature']]} (Model weight: {importance_pct:.1f}%)")
     
     st.subheader("Recommendations")
     if risk_level == "High":
@@ -259,12 +302,9 @@ if st.button("Predict Risk Level", type="primary"):
 if st.checkbox("Show Feature Importance"):
     st.subheader("Model Feature Importance")
     
-    feature_importance = pd.DataFrame({
-        'Feature': feature_columns,
-        'Importance': model.feature_importances_
-    }).sort_values('Importance', ascending=True)
+    feature_importance = feature_importance_table(model, tuple(feature_columns))
     
-    st.bar_chart(feature_importance.set_index('Feature'))
+    st.bar_chart(feature_importance.iloc[::-1].set_index('Feature'))
 
 st.markdown("""
 ---
@@ -1,36 +1,50 @@
 import pandas as pd
 import numpy as np
+try:
+    from sklearnex import patch_sklearn
+except ImportError:  # optional: stock scikit-learn is used without it
+    pass
+else:
+    # Route RandomForestClassifier through oneDAL; must run before sklearn.ensemble is imported
+    patch_sklearn(['random_forest_classifier'])
+
 from sklearn.model_selection import train_test_split
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.preprocessing import LabelEncoder
 from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
 import joblib
+import json
+import os
 import warnings
-warnings.filterwarnings('ignore')
+
+# Model input columns, in the order the forest is trained on
+FEATURE_ORDER = (
+    'Age', 'Systolic BP', 'Diastolic', 'BS', 'Body Temp', 'BMI',
+    'Previous Complications', 'Preexisting Diabetes', 'Gestational Diabetes',
+    'Mental Health', 'Heart Rate'
+)
+
+# Feature columns can be blank in the CSV, so all of them parse as float32 and are filled afterwards
+CSV_DTYPES = dict.fromkeys(FEATURE_ORDER, 'float32')
 
 def load_and_preprocess_data(file_path):
-    df = pd.read_csv(file_path)
+    df = pd.read_csv(file_path, usecols=[*CSV_DTYPES, 'Risk Level'], dtype=CSV_DTYPES)
     
     df = df.dropna(subset=['Risk Level'])
     
     numerical_cols = ['Age', 'Systolic BP', 'Diastolic', 'BS', 'Body Temp', 'BMI', 'Heart Rate']
-    for col in numerical_cols:
-        if col in df.columns:
-            df[col] = df[col].fillna(df[col].median())
+    df[numerical_cols] = df[numerical_cols].fillna(df[numerical_cols].median())
     
     categorical_cols = ['Previous Complications', 'Preexisting Diabetes', 'Gestational Diabetes', 'Mental Health']
-    for col in categorical_cols:
-        if col in df.columns:
-            df[col] = df[col].fillna(df[col].mode()[0])
+    df[categorical_cols] = df[categorical_cols].fillna(df[categorical_cols].mode().iloc[0])
     
     return df
 
 def train_model(df):
-    feature_columns = ['Age', 'Systolic BP', 'Diastolic', 'BS', 'Body Temp', 'BMI', 
-                      'Previous Complications', 'Preexisting Diabetes', 'Gestational Diabetes', 
-                      'Mental Health', 'Heart Rate']
+    feature_columns = list(FEATURE_ORDER)
     
-    X = df[feature_columns]
+    # The forest works in float32 internally, so hand it float32 arrays rather than DataFrames
+    X = df[feature_columns].to_numpy(dtype=np.float32)
     y = df['Risk Level']
     
     le = LabelEncoder()
@@ -43,7 +57,8 @@ def train_model(df):
         max_depth=10,
         min_samples_split=5,
         min_samples_leaf=2,
-        random_state=42
+        random_state=42,
+        n_jobs=1
     )
     
     rf_model.fit(X_train, y_train)
@@ -64,19 +79,37 @@ def train_model(df):
     print("\nFeature Importance:")
     print(feature_importance)
     
-    return rf_model, le, feature_columns
+    return rf_model, le, feature_columns, accuracy
+
+def export_compiled_model(model, location):
+    """Compile the forest into tensor ops with Hummingbird for faster scoring, when it is installed"""
+    # Never leave a compiled copy of an older forest next to the freshly saved one
+    if os.path.exists(location):
+        os.remove(location)
+    
+    try:
+        from hummingbird.ml import convert
+    except ImportError:
+        print("Hummingbird not installed; the app will score with the scikit-learn model")
+        return
+    
+    convert(model, 'torch').save(location)
+    print(f"Compiled model saved to {location}")
 
 def predict_risk(model, label_encoder, feature_columns, patient_data):
-    patient_df = pd.DataFrame([patient_data], columns=feature_columns)
+    patient_x = np.asarray([[patient_data[col] for col in feature_columns]], dtype=np.float32)
     
-    prediction = model.predict(patient_df)[0]
-    probability = model.predict_proba(patient_df)[0]
+    # One pass over the trees; labels are encoded 0..n-1, so the argmax is the predicted class
+    probability = model.predict_proba(patient_x)[0]
+    prediction = int(probability.argmax())
     
-    risk_level = label_encoder.inverse_transform([prediction])[0]
+    risk_level = label_encoder.classes_[prediction]
     
     return risk_level, probability
 
 def main():
+    warnings.filterwarnings('ignore')
+    
     print("Loading and preprocessing data...")
     df = load_and_preprocess_data('/Users/karthik/Projects/hackathon15092025/data/Dataset - Updated.csv')
     
@@ -85,11 +118,25 @@ def main():
     print(df['Risk Level'].value_counts())
     
     print("\nTraining model...")
-    model, label_encoder, feature_columns = train_model(df)
+    model, label_encoder, feature_columns, accuracy = train_model(df)
     
-    joblib.dump(model, '/Users/karthik/Projects/hackathon15092025/models/pregnancy_risk_model.pkl')
+    # The pickled trees compress well, which shrinks the file the app loads on every cold start
+    joblib.dump(model, '/Users/karthik/Projects/hackathon15092025/models/pregnancy_risk_model.pkl', compress=3)
     joblib.dump(label_encoder, '/Users/karthik/Projects/hackathon15092025/models/label_encoder.pkl')
     joblib.dump(feature_columns, '/Users/karthik/Projects/hackathon15092025/models/feature_columns.pkl')
+    # Plain string array, so the app can map predictions to labels without unpickling the encoder
+    np.save('/Users/karthik/Projects/hackathon15092025/models/pregnancy_risk_classes.npy', label_encoder.classes_.astype(str))
+    # The app reads accuracy and the dataset counts from here instead of loading the CSV at startup
+    risk_counts = df['Risk Level'].value_counts()
+    metrics = {
+        'accuracy': float(accuracy),
+        'n_total': len(df),
+        'n_high': int(risk_counts.get('High', 0)),
+        'n_low': int(risk_counts.get('Low', 0))
+    }
+    with open('/Users/karthik/Projects/hackathon15092025/models/metrics.json', 'w') as f:
+        json.dump(metrics, f, indent=2)
+    export_compiled_model(model, '/Users/karthik/Projects/hackathon15092025/models/pregnancy_risk_model_hb.zip')
     print("\nModel saved successfully!")
     
     print("\nModel training completed successfully!")
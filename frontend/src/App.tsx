@@ -82,7 +82,7 @@ function App() {
             entry.input_data?.BMI?.toString().includes(searchTerm)
         } else {
           return entry.predicted_label?.toLowerCase().includes(searchLower) ||
-            entry.image_filename?.toLowerCase().includes(searchLower)
+            (entry.original_filename || entry.image_filename)?.toLowerCase().includes(searchLower)
         }
       })
     }
@@ -273,7 +273,7 @@ function App() {
               </div>
               <div className="feature-card">
                 <h3>📊 Revolutionary Real-Time History</h3>
-                <p><strong>NEW:</strong> Unified medical_history.json storage with Flask API server, auto-refresh every 30 seconds, one-click cleanup tools, and instant image serving for complete medical record management.</p>
+                <p><strong>NEW:</strong> Per-user JSON Lines history logs with Flask API server, auto-refresh every 30 seconds, one-click cleanup tools, and instant image serving for complete medical record management.</p>
               </div>
               <div className="feature-card">
                 <h3>🔒 Military-Grade Enterprise Security</h3>
@@ -347,12 +347,12 @@ function App() {
                 <h3>🔒 Enterprise Security & Privacy</h3>
                 <p><strong>Authentication:</strong> Clerk enterprise-grade with rate limiting<br />
                   <strong>Data Isolation:</strong> User-specific encrypted folders<br />
-                  <strong>NEW:</strong> Unified medical_history.json storage<br />
+                  <strong>NEW:</strong> Per-user JSON Lines history logs<br />
                   <strong>HIPAA Ready:</strong> Local processing, no data transmission</p>
               </div>
               <div className="feature-card">
                 <h3>📁 Smart Data Management</h3>
-                <p><strong>NEW:</strong> Single unified medical_history.json per user<br />
+                <p><strong>NEW:</strong> Append-only JSON Lines history per user<br />
                   <strong>Deduplication:</strong> Content-based duplicate prevention<br />
                   <strong>Auto Cleanup:</strong> Smart file management with 7-day retention<br />
                   <strong>Image Serving:</strong> Direct API-based image access</p>
@@ -393,7 +393,7 @@ function App() {
               </div>
               <div className="feature-card">
                 <h3>📊 Revolutionary Data Management</h3>
-                <p><strong>NEW:</strong> Unified medical_history.json storage system with Flask API server, real-time updates every 30 seconds, intelligent duplicate prevention, and one-click cleanup tools for streamlined medical record management.</p>
+                <p><strong>NEW:</strong> Per-user JSON Lines history storage with Flask API server, real-time updates every 30 seconds, intelligent duplicate prevention, and one-click cleanup tools for streamlined medical record management.</p>
               </div>
               <div className="feature-card">
                 <h3>🔒 Military-Grade Security</h3>
@@ -663,13 +663,13 @@ function App() {
                 <div className="history-loading" style={{ textAlign: 'center', padding: '3rem' }}>
                   <div style={{ fontSize: '3rem', marginBottom: '1rem' }}>🔄</div>
                   <h3>Loading Medical History...</h3>
-                  <p>📁 <strong>Storage:</strong> uploads/{user?.id || 'session'}/medical_history.json</p>
+                  <p>📁 <strong>Storage:</strong> uploads/{user?.id || 'session'}/pregnancy_risk.jsonl, fetal_classification.jsonl</p>
                 </div>
               ) : !historyData || historyData.total === 0 ? (
                 <div className="history-loading" style={{ textAlign: 'center', padding: '3rem' }}>
                   <div style={{ fontSize: '4rem', marginBottom: '1rem' }}>📭</div>
                   <h3>No Medical History Found</h3>
-                  <p>📁 <strong>Storage:</strong> uploads/{user?.id || 'session'}/medical_history.json</p>
+                  <p>📁 <strong>Storage:</strong> uploads/{user?.id || 'session'}/pregnancy_risk.jsonl, fetal_classification.jsonl</p>
                   <div style={{
                     background: 'linear-gradient(135deg, #667eea, #764ba2)',
                     color: 'white',
@@ -792,7 +792,7 @@ function App() {
                               </div>
                             )}
                             <div style={{ fontSize: '0.9rem', color: '#6b7280' }}>
-                              📁 {entry.image_filename}
+                              📁 {entry.original_filename || entry.image_filename}
                             </div>
                           </div>
                         )}
@@ -942,7 +942,7 @@ function App() {
                 <div style={{ display: 'grid', gridTemplateColumns: 'repeat(auto-fit, minmax(250px, 1fr))', gap: '1rem' }}>
                   <div>
                     <strong>📁 File Location:</strong><br />
-                    uploads/{user?.id || 'session'}/medical_history.json
+                    uploads/{user?.id || 'session'}/pregnancy_risk.jsonl, fetal_classification.jsonl
                   </div>
                   <div>
                     <strong>🔄 Auto-Save:</strong><br />
@@ -1059,7 +1059,7 @@ function App() {
                               }}
                             />
                             <div style={{ marginTop: '0.5rem', fontSize: '0.9rem', color: '#6b7280' }}>
-                              📁 {selectedEntry.image_filename}
+                              📁 {selectedEntry.original_filename || selectedEntry.image_filename}
                             </div>
                           </div>
                         )}
@@ -6,7 +6,7 @@ import type { HistoryEntry, HistoryData } from './historyLoader';
 // API base URL - adjust based on your setup
 const API_BASE_URL = 'http://localhost:8503/api';
 
-// Load real history data from actual medical_history.json file via API
+// Load real history data from the user's history logs via API
 export const loadRealHistoryData = async (userId: string): Promise<HistoryData> => {
   try {
     const response = await fetch(`${API_BASE_URL}/history/${userId}`);
@@ -1,5 +1,5 @@
 // Simple history loader for medical AI dashboard
-// This reads the unified medical_history.json file and formats it for display
+// This reads the user's per-type history logs and formats them for display
 
 export interface HistoryEntry {
   id: string;
@@ -16,6 +16,7 @@ export interface HistoryEntry {
   };
   // Fetal classification specific
   image_filename?: string;
+  original_filename?: string;
   image_path?: string;
   predicted_label?: string;
   top_predictions?: Array<{
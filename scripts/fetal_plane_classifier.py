@@ -1,4 +1,6 @@
 import os
+import hashlib
+from functools import lru_cache
 import pandas as pd
 import numpy as np
 from PIL import Image
@@ -52,26 +54,118 @@ class FetalPlaneDataset(Dataset):
             if self.transform:
                 image = self.transform(image)
             
-            inputs = self.processor(images=image, return_tensors="pt")
-            pixel_values = inputs['pixel_values'].squeeze()
-            
+            # The processor runs once per batch in the collator
             return {
-                'pixel_values': pixel_values,
+                'image': image,
                 'labels': torch.tensor(self.labels[idx], dtype=torch.long)
             }
         except Exception as e:
             print(f"Error loading image {image_path}: {e}")
             return self.__getitem__((idx + 1) % len(self.image_paths))
 
+class CachedPixelDataset(Dataset):
+    """Serve preprocessed pixels from the float16 shard written by precompute_pixels"""
+    
+    def __init__(self, pixel_path, rows, labels):
+        self.pixel_path = pixel_path
+        self.rows = rows
+        self.labels = labels
+        self.pixels = None
+    
+    def __len__(self):
+        return len(self.rows)
+    
+    def __getitem__(self, idx):
+        # Opened lazily so each DataLoader worker maps the file itself
+        if self.pixels is None:
+            self.pixels = np.load(self.pixel_path, mmap_mode='r')
+        
+        return {
+            'pixel_values': torch.from_numpy(self.pixels[self.rows[idx]].astype(np.float32)),
+            'labels': torch.tensor(self.labels[idx], dtype=torch.long)
+        }
+
+def precompute_pixels(image_paths, processor, cache_dir, batch_size=64):
+    """Decode and normalise every image once into a float16 .npy shard.
+    
+    Returns the shard path and a boolean mask of the rows whose image decoded; unreadable
+    images are skipped and left as zeros in the shard.
+    """
+    # The shard is keyed by the image list, so a changed dataset gets a fresh one
+    digest = hashlib.sha1('\n'.join(image_paths).encode()).hexdigest()[:16]
+    pixel_path = os.path.join(cache_dir, f'pixel_cache_{digest}.npy')
+    mask_path = os.path.join(cache_dir, f'pixel_cache_{digest}.valid.npy')
+    if os.path.exists(pixel_path):
+        print(f"Using cached pixels: {pixel_path}")
+        if os.path.exists(mask_path):
+            return pixel_path, np.load(mask_path)
+        return pixel_path, np.ones(len(image_paths), dtype=bool)
+    
+    size = processor.size
+    height, width = (size['height'], size['width']) if isinstance(size, dict) else (size, size)
+    shape = (len(image_paths), 3, height, width)
+    cache_gb = np.prod(shape) * np.dtype(np.float16).itemsize / 1e9
+    print(f"Caching preprocessed pixels for {len(image_paths)} images "
+          f"({cache_gb:.1f} GB) to {pixel_path}; pass cache_pixels=False to skip")
+    
+    tmp_path = f"{pixel_path}.tmp"
+    pixels = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.float16, shape=shape)
+    valid = np.zeros(len(image_paths), dtype=bool)
+    
+    for start in range(0, len(image_paths), batch_size):
+        rows, images = [], []
+        for row, path in enumerate(image_paths[start:start + batch_size], start):
+            try:
+                images.append(Image.open(path).convert('RGB'))
+                rows.append(row)
+            except Exception as e:
+                print(f"Error loading image {path}: {e}")
+        if images:
+            pixels[rows] = processor(images=images, return_tensors="np")['pixel_values']
+            valid[rows] = True
+    
+    pixels.flush()
+    del pixels
+    # The mask lands first, so an existing shard always has its mask next to it
+    np.save(mask_path, valid)
+    os.replace(tmp_path, pixel_path)
+    return pixel_path, valid
+
+class ViTCollator:
+    """Batch collator that runs the ViT processor over the whole batch of PIL images at once.
+    
+    A module-level class rather than a closure so DataLoader workers can pickle it on spawn platforms.
+    """
+    
+    def __init__(self, processor):
+        self.processor = processor
+    
+    def __call__(self, batch):
+        if 'pixel_values' in batch[0]:
+            inputs = {'pixel_values': torch.stack([item['pixel_values'] for item in batch])}
+        else:
+            inputs = self.processor(images=[item['image'] for item in batch], return_tensors="pt")
+        inputs['labels'] = torch.stack([item['labels'] for item in batch])
+        return inputs
+
 def load_and_preprocess_data(data_dir):
     csv_path = os.path.join(data_dir, 'FETAL_PLANES_DB_data.csv')
     images_dir = os.path.join(data_dir, 'Images')
     
-    df = pd.read_csv(csv_path, delimiter=';')
+    # Only the name and label columns are used, and they are always filled in
+    usecols = ['Image_name', 'Plane', 'Brain_plane']
+    try:
+        # Multi-threaded parse into Arrow-backed string columns
+        df = pd.read_csv(csv_path, delimiter=';', engine='pyarrow', usecols=usecols, dtype_backend='pyarrow')
+    except ImportError:  # pyarrow not installed
+        df = pd.read_csv(csv_path, delimiter=';', engine='c', usecols=usecols, dtype=str, na_filter=False)
     
-    df['image_path'] = df['Image_name'].apply(lambda x: os.path.join(images_dir, f"{x}.png"))
+    # One directory scan instead of a stat() per row
+    existing_files = {entry.name for entry in os.scandir(images_dir)}
+    file_names = df['Image_name'] + '.png'
+    df['image_path'] = images_dir + os.sep + file_names
     
-    existing_images = df[df['image_path'].apply(os.path.exists)]
+    existing_images = df.loc[file_names.isin(existing_files)].copy()
     print(f"Found {len(existing_images)} existing images out of {len(df)} total entries")
     
     existing_images['combined_label'] = existing_images['Plane'] + '_' + existing_images['Brain_plane']
@@ -89,7 +183,7 @@ def compute_metrics(eval_pred):
     predictions = np.argmax(predictions, axis=1)
     return {'accuracy': accuracy_score(labels, predictions)}
 
-def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epochs=10, batch_size=16):
+def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epochs=10, batch_size=16, cache_pixels=True):
     print("🔬 Initializing Fetal Plane Classifier Training")
     print("=" * 50)
     
@@ -102,6 +196,8 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
     
     print("Loading and preprocessing data...")
     df, label_encoder = load_and_preprocess_data(data_dir)
+    # Positional index, so split rows address the matching pixel shard rows
+    df = df.reset_index(drop=True)
     
     model_name = "google/vit-base-patch16-224-in21k"
     processor = ViTImageProcessor.from_pretrained(model_name)
@@ -116,6 +212,14 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
     model = model.to(device)
     print(f"📱 Model moved to device: {device}")
     
+    if cache_pixels:
+        # Decode, resize and normalise once instead of every epoch
+        pixel_path, valid = precompute_pixels(df['image_path'].tolist(), processor, data_dir)
+        if not valid.all():
+            print(f"Skipping {int((~valid).sum())} unreadable images")
+            # Keep the original index: it is the row number in the pixel shard
+            df = df[valid]
+    
     train_df, val_df = train_test_split(
         df, 
         test_size=0.2, 
@@ -126,17 +230,38 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
     print(f"Training samples: {len(train_df)}")
     print(f"Validation samples: {len(val_df)}")
     
-    train_dataset = FetalPlaneDataset(
-        train_df['image_path'].tolist(),
-        train_df['encoded_label'].tolist(),
-        processor
-    )
-    
-    val_dataset = FetalPlaneDataset(
-        val_df['image_path'].tolist(),
-        val_df['encoded_label'].tolist(),
-        processor
-    )
+    if cache_pixels:
+        train_dataset = CachedPixelDataset(
+            pixel_path,
+            train_df.index.tolist(),
+            train_df['encoded_label'].tolist()
+        )
+        
+        val_dataset = CachedPixelDataset(
+            pixel_path,
+            val_df.index.tolist(),
+            val_df['encoded_label'].tolist()
+        )
+    else:
+        train_dataset = FetalPlaneDataset(
+            train_df['image_path'].tolist(),
+            train_df['encoded_label'].tolist(),
+            processor
+        )
+        
+        val_dataset = FetalPlaneDataset(
+            val_df['image_path'].tolist(),
+            val_df['encoded_label'].tolist(),
+            processor
+        )
+    
+    # bf16 autocast keeps fp32 master weights, so no loss scaling or fp32 head wrapper is needed
+    use_bf16 = device.type == 'cuda' and torch.cuda.is_bf16_supported()
+    if use_bf16:
+        print("⚡ bf16 mixed precision enabled")
+    
+    # MPS multiprocessing is unreliable, so only CUDA/CPU decode batches in worker processes
+    num_workers = 0 if device.type == 'mps' else max(1, (os.cpu_count() or 2) // 2)
     
     training_args = TrainingArguments(
         output_dir=output_dir,
@@ -154,10 +279,12 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
         greater_is_better=True,
         save_total_limit=2,
         remove_unused_columns=False,
-        dataloader_pin_memory=False,
-        dataloader_num_workers=0 if device.type == 'mps' else 2,
+        dataloader_pin_memory=device.type == 'cuda',
+        dataloader_num_workers=num_workers,
+        dataloader_persistent_workers=num_workers > 0,
+        dataloader_prefetch_factor=4 if num_workers > 0 else None,
         fp16=False,
-        bf16=False,
+        bf16=use_bf16,
         use_mps_device=device.type == 'mps',
         gradient_accumulation_steps=2 if device.type == 'mps' else 1,
         max_grad_norm=1.0,
@@ -170,6 +297,7 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
         args=training_args,
         train_dataset=train_dataset,
         eval_dataset=val_dataset,
+        data_collator=ViTCollator(processor),
         compute_metrics=compute_metrics,
     )
     
@@ -181,6 +309,11 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
     print(f"Validation Accuracy: {eval_results['eval_accuracy']:.4f}")
     
     print("Saving model and processor...")
+    # The app exports ONNX graphs next to the weights; never leave ones from an older model behind
+    for onnx_file in ('vit.onnx', 'vit.int8.onnx'):
+        onnx_path = os.path.join(output_dir, onnx_file)
+        if os.path.exists(onnx_path):
+            os.remove(onnx_path)
     model.save_pretrained(output_dir)
     processor.save_pretrained(output_dir)
     
@@ -191,7 +324,9 @@ def train_fetal_plane_classifier(data_dir, output_dir='./fetal_plane_model', epo
     
     return model, processor, label_encoder, eval_results
 
-def predict_fetal_plane(image_path, model_dir='./fetal_plane_model'):
+@lru_cache(maxsize=2)
+def load_fetal_plane_model(model_dir):
+    """Load the processor, model and label encoder once per model directory"""
     device = get_device()
     
     processor = ViTImageProcessor.from_pretrained(model_dir)
@@ -202,11 +337,16 @@ def predict_fetal_plane(image_path, model_dir='./fetal_plane_model'):
     import joblib
     label_encoder = joblib.load(os.path.join(model_dir, 'label_encoder.pkl'))
     
+    return processor, model, label_encoder, device
+
+def predict_fetal_plane(image_path, model_dir='./fetal_plane_model'):
+    processor, model, label_encoder, device = load_fetal_plane_model(model_dir)
+    
     image = Image.open(image_path).convert('RGB')
     inputs = processor(images=image, return_tensors="pt")
-    inputs = {k: v.to(device) for k, v in inputs.items()}
+    inputs = {k: v.to(device, non_blocking=True) for k, v in inputs.items()}
     
-    with torch.no_grad():
+    with torch.inference_mode():
         outputs = model(**inputs)
         predictions = torch.nn.functional.softmax(outputs.logits, dim=-1)
         predicted_class_idx = predictions.argmax().item()